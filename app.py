@@ -61,11 +61,11 @@ def cleanup_old_files():
     try:
         current_time = time.time()
         for folder in [UPLOAD_FOLDER, OUTPUT_FOLDER]:
-            for filename in os.listdir(folder):
-                filepath = os.path.join(folder, filename)
-                if os.path.getmtime(filepath) < current_time - 86400:  # 24 hours
-                    os.remove(filepath)
-                    logger.info(f"Cleaned up old file: {filepath}")
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.stat().st_mtime < current_time - 86400:  # 24 hours
+                        os.remove(entry.path)
+                        logger.info(f"Cleaned up old file: {entry.path}")
     except Exception as e:
         logger.error(f"Error during cleanup: {str(e)}")
 
@@ -1,15 +1,37 @@
 import os
-import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 
 db = SQLAlchemy()
 
+class UtcNow(FunctionElement):
+    """The current UTC time as a naive timestamp, computed by the database"""
+    type = db.DateTime()
+    inherit_cache = True
+
+@compiles(UtcNow)
+def _compile_utc_now(element, compiler, **kw):
+    # SQLite's CURRENT_TIMESTAMP is already UTC
+    return 'CURRENT_TIMESTAMP'
+
+@compiles(UtcNow, 'postgresql')
+def _compile_utc_now_postgresql(element, compiler, **kw):
+    # now() is in the session's time zone there; convert it to UTC
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
 def init_db(app):
     """Initialize the database with the Flask app"""
     db.init_app(app)
     with app.app_context():
         db.create_all()
         
+        # create_all() skips tables that already exist, so add any indexes
+        # that were introduced after the database was first created
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
+        
         # Create default preset if none exists
         if Preset.query.count() == 0:
             default_preset = Preset(name="Default")
@@ -20,7 +42,7 @@ class Preset(db.Model):
     """Visualization preset settings that users can save and reuse"""
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=UtcNow(), server_default=UtcNow(), index=True)
     
     # Visualization settings
     color = db.Column(db.String(20), default="#00FFFF")  # Color of bars
@@ -44,7 +66,7 @@ class Preset(db.Model):
         return {
             'id': self.id,
             'name': self.name,
-            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'created_at': self.created_at.isoformat(sep=' ', timespec='seconds'),
             'color': self.color,
             'bar_count': self.bar_count,
             'bar_width_ratio': self.bar_width_ratio,
@@ -64,7 +86,7 @@ class AudioFile(db.Model):
     display_name = db.Column(db.String(255), nullable=False)
     file_size = db.Column(db.Integer)  # Size in bytes
     duration = db.Column(db.Float)  # Duration in seconds
-    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=UtcNow(), server_default=UtcNow(), index=True)
 
 class ImageFile(db.Model):
     """Uploaded background images"""
@@ -74,17 +96,17 @@ class ImageFile(db.Model):
     width = db.Column(db.Integer)
     height = db.Column(db.Integer)
     file_size = db.Column(db.Integer)  # Size in bytes
-    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=UtcNow(), server_default=UtcNow(), index=True)
 
 class OutputVideo(db.Model):
     """Generated output videos"""
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
     display_name = db.Column(db.String(255), nullable=False)
-    audio_file_id = db.Column(db.Integer, db.ForeignKey('audio_file.id'))
-    image_file_id = db.Column(db.Integer, db.ForeignKey('image_file.id'))
-    preset_id = db.Column(db.Integer, db.ForeignKey('preset.id'))
-    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    audio_file_id = db.Column(db.Integer, db.ForeignKey('audio_file.id'), index=True)
+    image_file_id = db.Column(db.Integer, db.ForeignKey('image_file.id'), index=True)
+    preset_id = db.Column(db.Integer, db.ForeignKey('preset.id'), index=True)
+    created_at = db.Column(db.DateTime, default=UtcNow(), server_default=UtcNow(), index=True)
     
     # Relationships
     audio_file = db.relationship('AudioFile', backref='videos')
@@ -1,21 +1,383 @@
+"""
+Audio spectrum visualization: renders bar frames over a background image
+and encodes them with the audio into an MP4 via FFmpeg.
+
+process_audio_visualization is the single entry point.
+"""
 import os
+import shutil
 import numpy as np
 import librosa
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.patches as patches
+import soundfile as sf
+import scipy.fft as sfft
+from scipy.signal import get_window, lfilter
 import subprocess
 import tempfile
+import time
+import threading
 import logging
-import gc  # For garbage collection
+from collections import deque, namedtuple
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache, wraps
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from PIL import Image, ImageColor
+from numba import njit
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+__all__ = ['process_audio_visualization']
 
 logger = logging.getLogger(__name__)
 
+N_FFT = 2048
+# Number of frames windowed and transformed together in one rfft call
+FFT_BLOCK_FRAMES = 1024
+# Longest side of the background image; larger images are downsampled once
+MAX_BACKGROUND_SIZE = 1920
+# Opacity of the bars drawn over the background
+BAR_ALPHA = 0.7
+# Bins at or below -DB_RANGE dB are drawn as empty bars, 0 dB as full height
+DB_RANGE = 80.0
+# Lowest frequency covered by the bars (Hz); the highest is the Nyquist rate
+MEL_FMIN = 40.0
+
+# Minimum time between progress log lines (seconds)
+PROGRESS_LOG_INTERVAL = 1.0
+# Size of the pipe carrying raw frames to FFmpeg (bytes); larger than the
+# 64 KiB default so each frame crosses in a few big writes
+FRAME_PIPE_SIZE = 1 << 20
+# Videos rendered at the same time; further requests wait for a slot
+MAX_CONCURRENT_RENDERS = min(4, os.cpu_count() or 1)
+
+# Seconds before hardware encoders are probed again after a probe timed out
+ENCODER_PROBE_RETRY_DELAY = 300.0
+# Render node used by the VAAPI encoder (Linux)
+VAAPI_DEVICE = '/dev/dri/renderD128'
+
+# H.264 encoders to try, in order of preference, as (encoder, options placed
+# before the inputs, output options). The hardware encoders move encoding off
+# the CPU; libx264 is the fallback that always works.
+H264_ENCODERS = [
+    ('h264_nvenc', [], [
+        '-preset', 'p4', '-tune', 'hq', '-rc', 'vbr', '-cq', '23', '-b:v', '0', '-surfaces', '32',
+        '-profile:v', 'main', '-pix_fmt', 'yuv420p'
+    ]),
+    ('h264_qsv', ['-init_hw_device', 'qsv=hw', '-filter_hw_device', 'hw'], [
+        '-vf', 'format=nv12,hwupload=extra_hw_frames=64',
+        '-preset', 'veryfast', '-global_quality', '23', '-look_ahead', '0', '-async_depth', '4',
+        '-profile:v', 'main'
+    ]),
+    ('h264_vaapi', ['-vaapi_device', VAAPI_DEVICE], [
+        '-vf', 'format=nv12,hwupload', '-qp', '23', '-profile:v', 'main'
+    ]),
+    ('h264_videotoolbox', [], [
+        '-b:v', '8M', '-realtime', '1',
+        '-profile:v', 'main', '-pix_fmt', 'yuv420p'
+    ]),
+    ('h264_amf', [], [
+        '-quality', 'speed', '-rc', 'cqp', '-qp_i', '23', '-qp_p', '23',
+        '-profile:v', 'main', '-pix_fmt', 'yuv420p'
+    ]),
+]
+SOFTWARE_H264_ENCODER = ('libx264', [], [
+    '-preset', 'veryfast',
+    '-crf', '23',
+    '-profile:v', 'main',  # Plays back on older phones and browsers
+    '-pix_fmt', 'yuv420p'
+])
+
+def _bar_heights(bars_db, smoothing, responsiveness, bar_height_scale):
+    """
+    Turn the (n_frames, n_bars) band levels in dB into bar heights
+    
+    Maps [-DB_RANGE, 0] dB to 0-1 (scaled by responsiveness and clipped),
+    blends each frame with the previous one and applies the height scale.
+    The first frame is not smoothed.
+    """
+    # A fixed dB window keeps bar heights comparable between frames and stays
+    # finite on silent frames, unlike normalizing to each frame's min/max
+    amps = np.clip((bars_db + DB_RANGE) * (responsiveness / DB_RANGE), 0.0, 1.0)
+    
+    # prev * smoothing + new * (1 - smoothing) over all frames is a first
+    # order IIR filter along the time axis; starting its state at
+    # smoothing * amps[0] leaves the first frame unchanged
+    amps = lfilter(
+        np.array([1.0 - smoothing], dtype=amps.dtype),
+        np.array([1.0, -smoothing], dtype=amps.dtype),
+        amps,
+        axis=0,
+        zi=(amps[:1] * smoothing)
+    )[0]
+    return amps * bar_height_scale
+
+# Encoder picked by _select_h264_encoder, once the choice is final
+_h264_encoder = None
+# time.monotonic() before which a timed-out probe is not run again
+_h264_retry_after = 0.0
+_h264_encoder_lock = threading.Lock()
+
+def _select_h264_encoder():
+    """
+    Pick the first H.264 encoder from H264_ENCODERS that works on this machine
+    
+    FFmpeg lists encoders it was built with even when the hardware is missing,
+    so each listed one is checked with a one-frame test encode. The probes get
+    no stdin and a timeout so a misbehaving driver can't hang a render.
+    
+    The choice is made once per process: a failed test encode means the
+    hardware isn't there, so libx264 is remembered just like a working
+    hardware encoder. Only a probe that timed out (say the GPU was busy) is
+    tried again, and not before ENCODER_PROBE_RETRY_DELAY has passed.
+    """
+    global _h264_encoder, _h264_retry_after
+    with _h264_encoder_lock:
+        if _h264_encoder is not None:
+            return _h264_encoder
+        if shutil.which('ffmpeg') is None or time.monotonic() < _h264_retry_after:
+            return SOFTWARE_H264_ENCODER
+        try:
+            available = subprocess.run(
+                ['ffmpeg', '-hide_banner', '-encoders'],
+                stdin=subprocess.DEVNULL, capture_output=True, text=True, check=True, timeout=10
+            ).stdout
+        except subprocess.TimeoutExpired:
+            _h264_retry_after = time.monotonic() + ENCODER_PROBE_RETRY_DELAY
+            return SOFTWARE_H264_ENCODER
+        except (OSError, subprocess.SubprocessError):
+            available = ''
+        
+        timed_out = False
+        for encoder, global_args, encoder_args in H264_ENCODERS:
+            if f' {encoder} ' not in available:
+                continue
+            if encoder == 'h264_vaapi' and not os.path.exists(VAAPI_DEVICE):
+                continue
+            try:
+                subprocess.run(
+                    ['ffmpeg', '-hide_banner', '-v', 'error', *global_args,
+                     '-f', 'lavfi', '-i', 'color=black:size=256x256:duration=0.1',
+                     '-c:v', encoder, *encoder_args, '-frames:v', '1', '-f', 'null', '-'],
+                    stdin=subprocess.DEVNULL, capture_output=True, check=True, timeout=30
+                )
+            except subprocess.TimeoutExpired:
+                logger.warning(f"Hardware H.264 encoder {encoder} timed out in its test encode")
+                timed_out = True
+                continue
+            except (OSError, subprocess.SubprocessError):
+                logger.info(f"Hardware H.264 encoder {encoder} is not usable here")
+                continue
+            logger.info(f"Using hardware H.264 encoder {encoder}")
+            _h264_encoder = (encoder, global_args, encoder_args)
+            return _h264_encoder
+        
+        if timed_out:
+            _h264_retry_after = time.monotonic() + ENCODER_PROBE_RETRY_DELAY
+            return SOFTWARE_H264_ENCODER
+        _h264_encoder = SOFTWARE_H264_ENCODER
+        return _h264_encoder
+
+def _grow_pipe(pipe, size):
+    """Raise a pipe's kernel buffer to size bytes where the OS allows it (Linux)"""
+    if fcntl is None or not hasattr(fcntl, 'F_SETPIPE_SZ'):
+        return
+    try:
+        fcntl.fcntl(pipe.fileno(), fcntl.F_SETPIPE_SZ, size)
+    except OSError:
+        # Above /proc/sys/fs/pipe-max-size for this user; keep the default
+        pass
+
+def _read_ffmpeg_progress(stream, total_seconds, progress_callback):
+    """
+    Report FFmpeg's `-progress` key=value stream as a 0-100 percentage
+    
+    Runs on its own thread and always drains the stream to the end, so a
+    failing callback can't leave FFmpeg blocked on a full pipe.
+    """
+    for line in stream:
+        key, _, value = line.strip().partition(b'=')
+        try:
+            if key == b'out_time_us' and value.isdigit():
+                progress_callback(min(100.0, int(value) / (total_seconds * 1e6) * 100))
+            elif key == b'progress' and value == b'end':
+                progress_callback(100.0)
+        except Exception:
+            logger.exception("Progress callback failed")
+
+@lru_cache(maxsize=32)
+def _parse_color(color):
+    """Parse a color string (hex code or CSS name) into an (r, g, b) tuple"""
+    return ImageColor.getrgb(color)[:3]
+
+def _to_pixels(coords, limit):
+    """Round pixel coordinates to integers clipped to [0, limit]"""
+    return np.clip(np.rint(coords), 0, limit).astype(np.int32)
+
+@njit(cache=True, inline='always')
+def _blend_rect(canvas, x0, y0, x1, y1, color_term, keep):
+    """
+    Alpha-blend a solid color over canvas[y0:y1, x0:x1] (bounds already clipped)
+    
+    With alpha in 0-255, color_term is the color premultiplied by alpha and
+    keep is 255 - alpha, so both can be computed once per video and the blend
+    stays in integer math.
+    """
+    for y in range(y0, y1):
+        for x in range(x0, x1):
+            for c in range(3):
+                canvas[y, x, c] = (canvas[y, x, c] * keep + color_term[c] + 127) // 255
+
+@njit(cache=True)
+def _draw_bars(canvas, x0, y0, x1, y1, color_term, keep,
+               glow_effect, glow_x0, glow_y0, glow_x1, glow_y1, glow_color_term, glow_keep):
+    """
+    Blend every bar (and its glow, if enabled) onto the canvas in place
+    
+    Bars are drawn left to right with each glow right before its bar, so a
+    glow overlapping the previous bar is blended on top of it.
+    """
+    for j in range(x0.shape[0]):
+        # Add glow effect if enabled: a larger, more transparent rectangle
+        if glow_effect:
+            _blend_rect(canvas, glow_x0[j], glow_y0[j], glow_x1[j], glow_y1[j], glow_color_term, glow_keep)
+        
+        # Draw bar as rectangle with customized alpha
+        _blend_rect(canvas, x0[j], y0[j], x1[j], y1[j], color_term, keep)
+
+# Everything the frame workers need besides the bar heights. It depends only
+# on the image and the settings, so it is built once per video.
+_RenderState = namedtuple('_RenderState', [
+    'background_shape',
+    'img_height',
+    'x0',
+    'x1',
+    'base_row',
+    'bars_grow_down',
+    'bar_color_term',
+    'bar_keep',
+    'glow_effect',
+    'glow_extra',
+    'glow_x0',
+    'glow_x1',
+    'glow_color_term',
+    'glow_keep',
+])
+
+@contextmanager
+def _shared_array(array):
+    """Copy an array into a new shared memory block; yields the block's name"""
+    shm = shared_memory.SharedMemory(create=True, size=array.nbytes)
+    try:
+        np.copyto(np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf), array)
+        yield shm.name
+    finally:
+        shm.close()
+        shm.unlink()
+
+# Per-process frame rendering state, set in each worker by _init_render_worker
+_render_state = None
+_render_background_shm = None
+_render_background = None
+_render_canvas = None
+
+def _init_render_worker(state, background_name):
+    """ProcessPoolExecutor initializer: keep the shared render state in the worker"""
+    global _render_state, _render_background_shm, _render_background, _render_canvas
+    _render_state = state
+    # The background is read straight from the parent's shared memory block
+    # rather than pickled into every worker
+    _render_background_shm = shared_memory.SharedMemory(name=background_name)
+    _render_background = np.ndarray(state.background_shape, dtype=np.uint8, buffer=_render_background_shm.buf)
+    # Frame buffer reused for every frame this worker draws
+    _render_canvas = np.empty_like(_render_background)
+
+def _render_frame(bar_px_heights):
+    """Draw one frame in a worker process, using the state set by _init_render_worker"""
+    return _draw_frame(_render_state, _render_background, _render_canvas, bar_px_heights)
+
+def _draw_frame(state, background, canvas, bar_px_heights):
+    """Draw the bars for one frame onto canvas over the background; returns canvas"""
+    img_height = state.img_height
+    
+    # Row range of every bar (image rows, top = 0)
+    heights = bar_px_heights.astype(np.int32)
+    base_row = state.base_row
+    if state.bars_grow_down:
+        # Top half - bars go down from position
+        bar_top = np.full_like(heights, base_row)
+        bar_bottom = base_row + heights
+    else:
+        # Bottom half - bars go up from position
+        bar_top = base_row - heights
+        bar_bottom = np.full_like(heights, base_row)
+    y0 = np.clip(bar_top, 0, img_height)
+    y1 = np.clip(bar_bottom, 0, img_height)
+    
+    glow_y0 = np.clip(bar_top - state.glow_extra, 0, img_height)
+    glow_y1 = np.clip(bar_bottom + state.glow_extra, 0, img_height)
+    
+    # Draw bars onto a fresh copy of the background
+    np.copyto(canvas, background)
+    _draw_bars(
+        canvas,
+        state.x0, y0, state.x1, y1,
+        state.bar_color_term, state.bar_keep,
+        state.glow_effect,
+        state.glow_x0, glow_y0, state.glow_x1, glow_y1,
+        state.glow_color_term, state.glow_keep
+    )
+    
+    # The array goes straight back to the parent, which writes its buffer to
+    # FFmpeg; converting with tobytes() first would only add a frame copy
+    return canvas
+
+def _pool_frames(executor, all_bar_px_heights, in_flight):
+    """Draw frames on the pool and yield them in order, with at most in_flight queued"""
+    pending = deque()
+    for bar_px_heights in all_bar_px_heights:
+        pending.append(executor.submit(_render_frame, bar_px_heights))
+        if len(pending) >= in_flight:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+_render_slots = threading.BoundedSemaphore(MAX_CONCURRENT_RENDERS)
+# Renders currently holding a slot, and the number of cores given to the
+# render running on each thread
+_running_renders = 0
+_running_lock = threading.Lock()
+_render_cores = threading.local()
+
+def _limit_concurrency(func):
+    """
+    Run func in one of the MAX_CONCURRENT_RENDERS render slots, waiting for a free one
+    
+    When the slot is taken the cores are split between the renders running at
+    that moment, so a render on its own still uses the whole machine.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        global _running_renders
+        with _render_slots:
+            with _running_lock:
+                _running_renders += 1
+                _render_cores.count = max(1, (os.cpu_count() or 1) // _running_renders)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with _running_lock:
+                    _running_renders -= 1
+    return wrapper
+
+@_limit_concurrency
 def process_audio_visualization(
     audio_path, 
     image_path, 
     output_path, 
+    *,
     color='#00FFFF', 
     fps=30,
     bar_count=64,
@@ -26,7 +388,8 @@ def process_audio_visualization(
     responsiveness=1.0,
     smoothing=0.2,
     vertical_position=0.5,
-    horizontal_margin=0.1
+    horizontal_margin=0.1,
+    progress_callback=None
 ):
     """
     Process audio file to generate visualization frames, overlay on image, and create video
@@ -37,235 +400,264 @@ def process_audio_visualization(
     - output_path: Path where output MP4 will be saved
     - color: Color for the visualization (hex code)
     - fps: Frames per second for the output video
+    - progress_callback: Optional callable receiving the encode progress as
+      a percentage (0-100); it is called from a separate thread
+    
+    All settings after output_path are keyword-only; the bar, glow, animation
+    and position settings mirror the columns of models.Preset.
     """
     try:
-        logger.info("Loading audio file...")
-        # Load the audio file
-        y, sr = librosa.load(audio_path, sr=None)
+        # This render's share of the cores, for its FFT threads, frame
+        # workers and FFmpeg threads
+        cores = _render_cores.count
+        
+        logger.info("Reading audio file...")
+        # Only the header is read here; the samples are streamed block by
+        # block when the spectra are computed
+        info = sf.info(audio_path)
+        sr = info.samplerate
         
         # Get audio duration and calculate number of frames needed
-        duration = librosa.get_duration(y=y, sr=sr)
+        duration = info.frames / sr
         n_frames = int(duration * fps)
         
-        # Create a temporary directory for frames
-        frames_dir = tempfile.mkdtemp()
-        
         # Frame generation settings
-        frame_length = len(y) // n_frames
+        frame_length = info.frames // n_frames
+        
+        # Decode the background once, capped at the output resolution
+        with Image.open(image_path) as pil_img:
+            pil_img = pil_img.convert('RGB')
+        if max(pil_img.size) > MAX_BACKGROUND_SIZE:
+            original_size = pil_img.size
+            pil_img.thumbnail((MAX_BACKGROUND_SIZE, MAX_BACKGROUND_SIZE), Image.LANCZOS)
+            logger.info(f"Downsampled background from {original_size[0]}x{original_size[1]} to {pil_img.size[0]}x{pil_img.size[1]}")
+        
+        # Make sure width and height are even (required for H.264 encoding)
+        img_width, img_height = pil_img.size
+        adjusted_width = img_width if img_width % 2 == 0 else img_width - 1
+        adjusted_height = img_height if img_height % 2 == 0 else img_height - 1
+        
+        # Crop only if dimensions are odd; dropping the last row or column
+        # needs no resampling
+        if img_width % 2 != 0 or img_height % 2 != 0:
+            pil_img = pil_img.crop((0, 0, adjusted_width, adjusted_height))
+            logger.info(f"Cropped image from {img_width}x{img_height} to {adjusted_width}x{adjusted_height}")
+            img_width, img_height = adjusted_width, adjusted_height
+        
+        img = np.ascontiguousarray(np.asarray(pil_img))
+        color_rgb = np.array(_parse_color(color), dtype=np.uint16)
         
         logger.info(f"Generating {n_frames} visualization frames...")
         
-        # Generate frames with visualization
-        for i in range(n_frames):
-            start_idx = i * frame_length
-            end_idx = min((i + 1) * frame_length, len(y))
-            
-            if start_idx >= len(y):
-                break
-                
-            segment = y[start_idx:end_idx]
-            
-            # Calculate spectrum using Short-time Fourier transform (STFT)
-            D = np.abs(librosa.stft(segment, n_fft=2048, hop_length=512))
-            
-            # Convert to decibels
-            D_db = librosa.amplitude_to_db(D, ref=np.max)
-            
-            # Plot the spectrum
-            plt.figure(figsize=(10, 4))
-            plt.imshow(plt.imread(image_path))
-            
-            # Get image dimensions to size the spectrum visualization
-            img = plt.imread(image_path)
-            img_height, img_width = img.shape[0], img.shape[1]
-            
-            # Make sure width and height are even (required for H.264 encoding)
-            # We need to resize the actual image, not just the figure
-            from PIL import Image
-            
-            # Load image with PIL to resize if needed
-            pil_img = Image.open(image_path)
-            adjusted_width = img_width if img_width % 2 == 0 else img_width - 1
-            adjusted_height = img_height if img_height % 2 == 0 else img_height - 1
-            
-            # Resize only if dimensions are odd
-            if img_width % 2 != 0 or img_height % 2 != 0:
-                pil_img = pil_img.resize((adjusted_width, adjusted_height))
-                
-                # Save the resized image to a temporary file
-                temp_image_path = os.path.join(tempfile.gettempdir(), "resized_image.png")
-                pil_img.save(temp_image_path)
-                
-                # Use the resized image instead
-                img = plt.imread(temp_image_path)
-                logger.info(f"Resized image from {img_width}x{img_height} to {adjusted_width}x{adjusted_height}")
-            
-            # Create a new figure for the spectrogram with adjusted size
-            fig, ax = plt.subplots(figsize=(adjusted_width/100, adjusted_height/100), dpi=100)
-            
-            # Plot the background image with correct orientation (not upside down)
-            ax.imshow(img, origin='upper')
-            
-            # Calculate frequency bins to show (focus on audible range)
-            # Use the bar_count parameter for the number of frequency bins
-            n_bins = min(128, D_db.shape[0])
-            D_db_subset = D_db[:n_bins, :]
-            
-            # Calculate average amplitude across time for each frequency bin
-            # Apply responsiveness multiplier
-            avg_amplitudes = np.mean(D_db_subset, axis=1) * responsiveness
-            
-            # Normalize to 0-1 range for visualization
-            normalized_amps = (avg_amplitudes - np.min(avg_amplitudes)) / (np.max(avg_amplitudes) - np.min(avg_amplitudes))
-            
-            # Apply smoothing between frames if needed
-            prev_heights_var = getattr(process_audio_visualization, '_prev_heights', None)
-            if i > 0 and smoothing > 0 and prev_heights_var is not None:
-                try:
-                    # Apply smoothing between frames
-                    normalized_amps = prev_heights_var * smoothing + normalized_amps * (1 - smoothing)
-                except Exception as e:
-                    logger.warning(f"Smoothing error: {e}")
-            
-            # Store current heights for next frame as an attribute of the function
-            # This is a bit of a hack but lets us avoid global variables
-            process_audio_visualization._prev_heights = normalized_amps.copy()
-            
-            # Calculate bar positions and heights using custom parameters
-            n_bars = bar_count  # Number of bars to display
-            
-            # Adjust width based on ratio parameter
-            effective_width = img_width * (1 - 2 * horizontal_margin)
-            bar_width = (effective_width * bar_width_ratio) / n_bars
-            bar_spacing = (effective_width * (1 - bar_width_ratio)) / (n_bars - 1)
-            
-            # Resample to desired number of bars
-            bars_heights = np.interp(
-                np.linspace(0, len(normalized_amps) - 1, n_bars),
-                np.arange(len(normalized_amps)),
-                normalized_amps
-            )
-            
-            # Apply height scaling
-            bars_heights = bars_heights * bar_height_scale
-            
-            # Determine vertical position
-            # vertical_position: 0.0 = top, 1.0 = bottom, 0.5 = center
-            margin_x = img_width * horizontal_margin  # Horizontal margin
-            
-            # Calculate vertical positioning
-            bar_section_height = img_height * 0.8  # Height of the section where bars appear
-            base_y = img_height * (0.1 + 0.8 * vertical_position)
-            max_bar_height = bar_section_height * 0.8
-            
-            # Draw bars
-            for j, height in enumerate(bars_heights):
-                bar_height = height * max_bar_height
-                x_pos = margin_x + j * (bar_width + bar_spacing)
-                
-                # Calculate y position based on vertical_position
-                if vertical_position <= 0.5:
-                    # Top half - bars go down from position
-                    y_pos = base_y
-                    rect_y = y_pos
-                    rect_height = bar_height
-                else:
-                    # Bottom half - bars go up from position
-                    y_pos = base_y - bar_height
-                    rect_y = y_pos
-                    rect_height = bar_height
+        # One mel band per bar, so each frame's spectrum is reduced to bar
+        # levels with a single matrix product. Each triangle is scaled to sum
+        # to 1, making a bar the weighted mean magnitude of its band, so wide
+        # high-frequency bands are not inflated relative to narrow low ones.
+        n_bars = bar_count  # Number of bars to display
+        mel_basis = librosa.filters.mel(
+            sr=sr,
+            n_fft=N_FFT,
+            n_mels=n_bars,
+            fmin=MEL_FMIN,
+            fmax=sr / 2,
+            norm=None,
+            dtype=np.float32
+        )
+        band_weight = mel_basis.sum(axis=1, keepdims=True)
+        mel_basis_t = np.ascontiguousarray((mel_basis / np.maximum(band_weight, 1e-10)).T)
+        
+        # An STFT with one window per video frame, centered on the frame
+        # start (zero padded at both ends). The audio is read one block of
+        # frames at a time, so memory stays flat however long the file is.
+        window = get_window('hann', N_FFT).astype(np.float32)
+        D = np.empty((n_frames, n_bars), dtype=np.float32)
+        with sf.SoundFile(audio_path) as audio:
+            for start in range(0, n_frames, FFT_BLOCK_FRAMES):
+                count = min(FFT_BLOCK_FRAMES, n_frames - start)
                 
-                # Add glow effect if enabled
-                if glow_effect:
-                    # Create a larger, more transparent rectangle for glow
-                    glow_extra = bar_width * 0.5 * glow_intensity
-                    glow_rect = patches.Rectangle(
-                        (x_pos - glow_extra, rect_y - glow_extra),
-                        bar_width + 2 * glow_extra,
-                        rect_height + 2 * glow_extra,
-                        color=color,
-                        alpha=0.3 * glow_intensity,
-                        edgecolor='none'
-                    )
-                    ax.add_patch(glow_rect)
+                # Samples covered by this block's windows, including the
+                # N_FFT - frame_length overlap with the next block
+                first = start * frame_length - N_FFT // 2
+                last = (start + count - 1) * frame_length + N_FFT // 2
+                lead = max(-first, 0)
+                audio.seek(first + lead)
+                # Mix down to mono the same way librosa.load does
+                samples = audio.read(last - first - lead, dtype='float32', always_2d=True).mean(axis=1)
+                samples = np.pad(samples, (lead, last - first - lead - len(samples)))
                 
-                # Draw bar as rectangle with customized alpha
-                rect = patches.Rectangle(
-                    (x_pos, rect_y),
-                    bar_width,
-                    rect_height,
-                    color=color,
-                    alpha=0.7
-                )
-                ax.add_patch(rect)
-            
-            # Remove axes and set limits
-            ax.axis('off')
-            ax.set_xlim(0, img_width)
-            ax.set_ylim(0, img_height)
-            
-            # Save frame
-            frame_path = os.path.join(frames_dir, f"frame_{i:04d}.png")
-            plt.savefig(frame_path, bbox_inches='tight', pad_inches=0)
-            plt.close('all')
-            
-            if i % 10 == 0:
-                logger.info(f"Generated frame {i}/{n_frames}")
+                # The frames are a strided view of the block, and the FFTs in
+                # each block are spread over this render's cores
+                frames = np.lib.stride_tricks.sliding_window_view(samples, N_FFT)[::frame_length]
+                spectra = np.abs(sfft.rfft(frames * window, axis=-1, workers=cores))
+                np.matmul(spectra, mel_basis_t, out=D[start:start + count])
+        
+        # Convert to decibels against a fixed reference (the peak STFT
+        # magnitude of a full-scale sine), so 0 dB means full scale
+        bars_db = librosa.amplitude_to_db(D, ref=N_FFT / 4, top_db=None)
         
-        logger.info("All frames generated. Creating video...")
+        # Bar layout depends only on the image size and settings, so it is
+        # computed once for all frames
+        # Adjust width based on ratio parameter
+        effective_width = img_width * (1 - 2 * horizontal_margin)
+        bar_width = (effective_width * bar_width_ratio) / n_bars
+        bar_spacing = (effective_width * (1 - bar_width_ratio)) / (n_bars - 1)
+        margin_x = img_width * horizontal_margin  # Horizontal margin
+        bar_left = margin_x + np.arange(n_bars) * (bar_width + bar_spacing)
+        x0 = _to_pixels(bar_left, img_width)
+        x1 = _to_pixels(bar_left + bar_width, img_width)
         
-        # Create video from frames using FFmpeg
-        frames_pattern = os.path.join(frames_dir, "frame_%04d.png")
+        # Determine vertical position
+        # vertical_position: 0.0 = top, 1.0 = bottom, 0.5 = center
+        bar_section_height = img_height * 0.8  # Height of the section where bars appear
+        base_row = int(round(img_height * (0.1 + 0.8 * vertical_position)))
+        max_bar_height = bar_section_height * 0.8
         
-        # Build FFmpeg command
+        # Glow is drawn as a larger, more transparent rectangle behind each bar
+        glow_extra = bar_width * 0.5 * glow_intensity
+        glow_extra_px = int(round(glow_extra))
+        
+        # Blend factors in 1/255 steps so frames are drawn with integer math
+        glow_alpha = int(round(255 * 0.3 * glow_intensity))
+        bar_alpha = int(round(255 * BAR_ALPHA))
+        glow_color_term = color_rgb * glow_alpha
+        bar_color_term = color_rgb * bar_alpha
+        glow_x0 = _to_pixels(bar_left - glow_extra, img_width)
+        glow_x1 = _to_pixels(bar_left + bar_width + glow_extra, img_width)
+        
+        # Smoothing runs along the time axis, so the heights for every frame
+        # are computed up front in one vectorized pass
+        all_bars_heights = _bar_heights(
+            bars_db, smoothing, responsiveness, bar_height_scale
+        )
+        
+        # Quantize to whole-pixel bar heights; this is all the workers need
+        all_bar_px_heights = np.clip(
+            np.rint(all_bars_heights * max_bar_height), 0, img_height
+        ).astype(np.uint16)
+        
+        # Sent to each worker process once instead of with every frame; the
+        # background itself is shared separately
+        render_state = _RenderState(
+            background_shape=img.shape,
+            img_height=img_height,
+            x0=x0,
+            x1=x1,
+            base_row=base_row,
+            bars_grow_down=vertical_position <= 0.5,
+            bar_color_term=bar_color_term,
+            bar_keep=255 - bar_alpha,
+            glow_effect=glow_effect,
+            glow_extra=glow_extra_px,
+            glow_x0=glow_x0,
+            glow_x1=glow_x1,
+            glow_color_term=glow_color_term,
+            glow_keep=255 - glow_alpha,
+        )
+        
+        # Build FFmpeg command; frames arrive on stdin as raw RGB, so nothing
+        # is written to or read back from disk
+        encoder, encoder_global_args, encoder_args = _select_h264_encoder()
         ffmpeg_cmd = [
             'ffmpeg',
             '-y',  # Overwrite output file if it exists
+            # The RGB to YUV conversion runs in FFmpeg's filter graph
+            '-filter_threads', str(cores),
+            *encoder_global_args,
+            '-f', 'rawvideo',
+            '-pix_fmt', 'rgb24',
+            '-s', f'{img_width}x{img_height}',
             '-framerate', str(fps),
-            '-i', frames_pattern,
+            '-i', '-',
             '-i', audio_path,
-            '-c:v', 'libx264',
-            '-pix_fmt', 'yuv420p',
+            '-c:v', encoder,
+            *encoder_args,
+            # With the machine to itself the encoder picks its own thread count
+            '-threads', '0' if cores == (os.cpu_count() or 1) else str(cores),
             '-c:a', 'aac',
-            '-strict', 'experimental',
             '-shortest',
+            '-movflags', '+faststart',  # Index up front so browsers can start playback early
+            '-max_muxing_queue_size', '4096',  # Room for video packets while audio catches up
             output_path
         ]
+        if progress_callback is not None:
+            # Machine-readable progress on stdout instead of stats on stderr
+            ffmpeg_cmd[1:1] = ['-progress', 'pipe:1', '-nostats']
         
         # Execute FFmpeg command
-        logger.info("Running FFmpeg to create video...")
+        logger.info(f"Running FFmpeg to create video ({img_width}x{img_height}, {encoder})...")
         try:
-            # Before running FFmpeg, let's verify the dimensions of the frames
-            # Check the first frame
-            first_frame_path = os.path.join(frames_dir, "frame_0000.png")
-            if os.path.exists(first_frame_path):
-                from PIL import Image
-                with Image.open(first_frame_path) as img:
-                    width, height = img.size
-                    logger.info(f"Frame dimensions: {width}x{height}")
-                    
-                    # If width or height is odd, resize all frames
-                    if width % 2 != 0 or height % 2 != 0:
-                        logger.info("Fixing odd dimensions in frames...")
-                        new_width = width if width % 2 == 0 else width - 1
-                        new_height = height if height % 2 == 0 else height - 1
+            # FFmpeg's log goes to a temporary file rather than a pipe, so it
+            # can never fill up and stall FFmpeg while frames are written
+            with tempfile.TemporaryFile() as ffmpeg_log:
+                process = subprocess.Popen(
+                    ffmpeg_cmd,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.DEVNULL if progress_callback is None else subprocess.PIPE,
+                    stderr=ffmpeg_log,
+                    bufsize=FRAME_PIPE_SIZE
+                )
+                _grow_pipe(process.stdin, FRAME_PIPE_SIZE)
+                progress_reader = None
+                if progress_callback is not None:
+                    progress_reader = threading.Thread(
+                        target=_read_ffmpeg_progress,
+                        args=(process.stdout, n_frames / fps, progress_callback),
+                        daemon=True
+                    )
+                    progress_reader.start()
+                try:
+                    # Drawing frames is independent per frame, so spread it
+                    # over this render's share of the cores. Only a few frames
+                    # per worker are kept in flight so memory stays flat if
+                    # FFmpeg is the bottleneck.
+                    workers = cores
+                    with ExitStack() as stack:
+                        if workers == 1:
+                            # A pool of one would only add pickling and IPC;
+                            # draw in this process, reusing one frame buffer
+                            canvas = np.empty_like(img)
+                            rendered = (
+                                _draw_frame(render_state, img, canvas, bar_px_heights)
+                                for bar_px_heights in all_bar_px_heights
+                            )
+                        else:
+                            background_name = stack.enter_context(_shared_array(img))
+                            executor = stack.enter_context(ProcessPoolExecutor(
+                                max_workers=workers,
+                                initializer=_init_render_worker,
+                                initargs=(render_state, background_name)
+                            ))
+                            rendered = _pool_frames(executor, all_bar_px_heights, workers * 4)
                         
-                        # Resize all frames to ensure even dimensions
-                        for file in os.listdir(frames_dir):
-                            if file.startswith("frame_") and file.endswith(".png"):
-                                frame_path = os.path.join(frames_dir, file)
-                                with Image.open(frame_path) as frame:
-                                    resized = frame.resize((new_width, new_height))
-                                    resized.save(frame_path)
-            
-            # Run FFmpeg with detailed output for debugging
-            process = subprocess.run(
-                ffmpeg_cmd, 
-                check=True, 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE,
-                text=True
-            )
+                        last_log = time.monotonic()
+                        for written, frame in enumerate(rendered, 1):
+                            process.stdin.write(frame)
+                            # Throttled by time rather than frame count,
+                            # so long renders don't flood the log
+                            now = time.monotonic()
+                            if now - last_log >= PROGRESS_LOG_INTERVAL or written == n_frames:
+                                logger.info(f"Generated frame {written}/{n_frames}")
+                                last_log = now
+                    process.stdin.close()
+                except BrokenPipeError:
+                    # FFmpeg exited early; its log below says why
+                    pass
+                except Exception:
+                    process.kill()
+                    process.wait()
+                    raise
+                
+                returncode = process.wait()
+                if progress_reader is not None:
+                    progress_reader.join()
+                    process.stdout.close()
+                if returncode != 0:
+                    ffmpeg_log.seek(0)
+                    raise subprocess.CalledProcessError(
+                        returncode,
+                        ffmpeg_cmd,
+                        stderr=ffmpeg_log.read().decode(errors='replace')
+                    )
             
             if not os.path.exists(output_path):
                 logger.error("FFmpeg completed but output file was not created")
@@ -284,25 +676,8 @@ def process_audio_visualization(
             logger.error(f"Error verifying output file: {str(e)}")
             raise
         
-        # Clean up temporary frames
-        for file in os.listdir(frames_dir):
-            os.remove(os.path.join(frames_dir, file))
-        os.rmdir(frames_dir)
-        
         return True
         
     except Exception as e:
         logger.error(f"Error in process_audio_visualization: {str(e)}", exc_info=True)
-        # Clean up any temporary files
-        frames_dir_var = locals().get('frames_dir')
-        if frames_dir_var and os.path.exists(frames_dir_var):
-            for file in os.listdir(frames_dir_var):
-                try:
-                    os.remove(os.path.join(frames_dir_var, file))
-                except Exception as cleanup_error:
-                    logger.error(f"Error removing frame file: {cleanup_error}")
-            try:
-                os.rmdir(frames_dir_var)
-            except Exception as cleanup_error:
-                logger.error(f"Error removing frames directory: {cleanup_error}")
         raise